@@ -14,15 +14,27 @@
 ###################
 
 import os
+import argparse
+import errno
+import glob
+import logging
 from obspy import read
-import pandas as pd
-import datetime
+from obspy.core.util.obspy_types import ObsPyException
 import subprocess
-from datetime import date, timedelta
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import shutil
+import tempfile
 import numpy as np
-import traceback
+from scipy import sparse
+from scipy.signal import windows
+from joblib import Parallel, delayed
 
 
+__all__ = ['get_paramString', 'tukey_lut', 'ko_matrix_lut', 'hv_python', 'geopsy_window', 'run_HV', 'read_files']
+
+log = logging.getLogger(__name__)
+
 # Linux
 #geopsy_exe = "geopsy-hv"
 # Windows - locate the Geopsypack.win64-3.4.2 folder
@@ -40,39 +52,278 @@ def get_paramString():
     paramsString = '''PARAMETERS_VERSION=1    \nFROM_TIME_TYPE=Absolute\nFROM_TIME_TEXT={tStart}\nTO_TIME_TYPE=Absolute\nTO_TIME_TEXT={tEnd}\nREFERENCE=\nCOMMON_TIME_WINDOWS=false\nWINDOW_LENGTH_TYPE=Exactly\nWINDOW_MIN_LENGTH(s)={winLen}\nWINDOW_MAX_LENGTH(s)={winLen}\nWINDOW_MAX_COUNT=0\nWINDOW_MAXIMUM_PRIME_FACTOR=11\nBAD_SAMPLE_TOLERANCE (s)=0\nBAD_SAMPLE_GAP (s)=0\nWINDOW_OVERLAP (%)={overlap}\nBAD_SAMPLE_THRESHOLD_TYPE={threshold}\nBAD_SAMPLE_THRESHOLD_VALUE (%)={threshold_pct}\nANTI-TRIGGERING_ON_RAW_SIGNAL (y/n)=n\nANTI-TRIGGERING_ON_FILTERED_SIGNAL (y/n)=n\nSEISMIC_EVENT_TRIGGER (y/n)=n\nSEISMIC_EVENT_DELAY (s)=-0.1\nWINDOW_TYPE=Tukey\nWINDOW_REVERSED=n\nWINDOW_ALPHA=0.1\nSMOOTHING_METHOD=Function\nSMOOTHING_WIDTH_TYPE=Log\nSMOOTHING_WIDTH={KO}\nSMOOTHING_SCALE_TYPE=Log\nSMOOTHING_WINDOW_TYPE=KonnoOhmachi\nSMOOTHING_WINDOW_REVERSED=n\nMINIMUM_FREQUENCY={minFreq}\nMAXIMUM_FREQUENCY={maxFreq}\nSCALE_TYPE_FREQUENCY=Log\nSTEP_TYPE_FREQUENCY=Count\nSAMPLES_NUMBER_FREQUENCY={N_samples}\n#STEP_FREQUENCY=1.00231\nHIGH_PASS_FREQUENCY=0\nHORIZONTAL_COMPONENTS={horizontals}\nHORIZONTAL_AZIMUTH={azimuth}\nROTATION_STEP={rotSteps}\nFREQUENCY_WINDOW_REJECTION_MINIMUM_FREQUENCY={rej_min_freq}\nFREQUENCY_WINDOW_REJECTION_MAXIMUM_FREQUENCY={rej_max_freq}\nFREQUENCY_WINDOW_REJECTION_STDDEV_FACTOR={rej_stdev}\nFREQUENCY_WINDOW_REJECTION_MAXIMUM_ITERATIONS={rej_it}\n'''
     return paramsString
 
-def run_HV(wf):
+## Tapers and smoothing matrices already computed, see tukey_lut and ko_matrix_lut.
+## Plain dicts rather than functools.lru_cache, which cannot be sent to the joblib workers when the script is run
+_TUKEY_LUT = {}
+_KO_LUT = {}
+
+def tukey_lut(n, alpha):
+    """Tukey taper of n samples, computed once per window length."""
+    if (n, alpha) not in _TUKEY_LUT:
+        taper = windows.tukey(n, alpha)
+        taper.setflags(write=False)
+        _TUKEY_LUT[n, alpha] = taper
+    return _TUKEY_LUT[n, alpha]
+
+def ko_matrix_lut(nwin, fs, min_freq, max_freq, N_samples, b):
+    """
+    Konno-Ohmachi smoothing as a sparse (N_samples, nwin//2+1) matrix, computed once per window length and sampling
+    rate. Row j holds the normalised weights that smooth an rfft amplitude spectrum onto the j-th of the N_samples
+    log-spaced centre frequencies between min_freq and max_freq. b is the Konno-Ohmachi bandwidth coefficient.
+    Only the main lobe and the first two side lobes (|b log10(f/fc)| <= 3 pi) are kept, the rest is negligible.
+    Returns the centre frequencies and the matrix.
+    """
+    key = (nwin, fs, min_freq, max_freq, N_samples, b)
+    if key in _KO_LUT:
+        return _KO_LUT[key]
+    f = np.fft.rfftfreq(nwin, 1./fs)
+    fc = np.logspace(np.log10(min_freq), np.log10(max_freq), N_samples)
+    reach = 10**(3*np.pi/b)
+    k_min = np.clip((fc/reach/f[1]).astype(np.int64), 1, f.size)
+    k_max = np.clip((fc*reach/f[1]).astype(np.int64) + 1, k_min, f.size)
+    counts = k_max - k_min
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    indices = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - k_min, counts)
+    x = b*np.log10(f[indices]/np.repeat(fc, counts))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.where(x == 0, 1., (np.sin(x)/x)**4)
+    w[np.abs(x) > 3*np.pi] = 0
+    W = sparse.csr_matrix((w, indices, indptr), shape=(fc.size, f.size))
+    with np.errstate(divide='ignore'):
+        W = sparse.diags(1./np.asarray(W.sum(axis=1)).ravel()) @ W
+    fc.setflags(write=False)
+    _KO_LUT[key] = fc, W.tocsr()
+    return _KO_LUT[key]
+
+def _get_component(st, codes):
+    """Return the first trace of st with one of the component codes, e.g. 'N1' for a north or first horizontal."""
+    for code in codes:
+        sel = st.select(component=code)
+        if len(sel):
+            return sel[0]
+    raise ValueError('no %s component in %s'%(' or '.join(codes), st))
+
+def hv_python(st, hv_file, time_window_len, win_overlap, KO, min_freq, max_freq, N_samples,
+              horizontals_method, azimuth, rej_min_freq, rej_max_freq, rej_stdev, rej_it):
+    """
+    In-process alternative to geopsy-hv: compute the H/V curve of a 3-component stream and write it to hv_file
+    in the same layout as the Geopsy .hv output, so that the notebooks can read it with read_HV/get_params_from_HV.
+    Windows with gaps are skipped, windows are rejected in the frequency domain following Cox et al. (2020) and the
+    average curve is the geometric mean of the remaining windows (Min/Max = average divided/multiplied by the std).
+    """
+    st = st.copy().merge()
+    Z = _get_component(st, 'Z')
+    N = _get_component(st, 'N1')
+    E = _get_component(st, 'E2')
+    fs = Z.stats.sampling_rate
+    t0 = max(tr.stats.starttime for tr in (Z, N, E))
+    t1 = min(tr.stats.endtime for tr in (Z, N, E))
+
+    ## cut the three components into overlapping windows of time_window_len, the windows are views into the traces
+    nwin = int(round(time_window_len*fs))
+    step = max(1, int(nwin*(1 - win_overlap/100.)))
+    views, gaps = [], []
+    for tr in (Z, N, E):
+        tr = tr.slice(t0, t1)
+        x = np.ma.filled(np.ma.masked_invalid(np.ma.asarray(tr.data, dtype=np.float64)), np.nan)
+        if len(x) < nwin:
+            raise ValueError('less than one window of %ss in %s'%(time_window_len, tr.id))
+        views.append(np.lib.stride_tricks.sliding_window_view(x, nwin)[::step])
+        ## a window holds a gap when the running count of NaN samples changes over it
+        nan_count = np.concatenate(([0], np.cumsum(np.isnan(x))))
+        win_start = np.arange(len(views[-1]))*step
+        gaps.append(nan_count[win_start + nwin] != nan_count[win_start])
+    ## the components can differ by a sample after slicing, keep the windows they have in common
+    n_common = min(len(v) for v in views)
+    good = np.flatnonzero(~np.any([g[:n_common] for g in gaps], axis=0))
+    if good.size == 0:
+        raise ValueError('no window without gaps for %s'%Z.id)
+
+    ## Konno-Ohmachi smoothing on the log-spaced output frequencies, the Geopsy log smoothing width is the
+    ## width of the main lobe in log10(f), which corresponds to b = 2 pi / KO.
+    ## The smoothing weights are cached, so every window is smoothed by one sparse matrix product
+    taper = tukey_lut(nwin, 0.1)
+    fc, W = ko_matrix_lut(nwin, fs, min_freq, max_freq, N_samples, 2*np.pi/KO)
+
+    ## the windows are copied and transformed in chunks of about 4M samples per component, so that long
+    ## process_len or large overlaps do not hold every window of the file in memory at once
+    chunk = max(1, 2**22//nwin)
+    HV = np.empty((good.size, fc.size))
+    for k in range(0, good.size, chunk):
+        data = np.stack([v[good[k:k+chunk]] for v in views])
+        ## demean, 5% Tukey taper on both sides (WINDOW_ALPHA=0.1) and amplitude spectra
+        data -= data.mean(axis=-1, keepdims=True)
+        data *= taper
+        sZ, sN, sE = np.fft.rfft(data, axis=-1)
+        if horizontals_method == 'Squared':
+            H = np.sqrt((np.abs(sN)**2 + np.abs(sE)**2)/2)
+        elif horizontals_method == 'Energy':
+            H = np.sqrt(np.abs(sN)**2 + np.abs(sE)**2)
+        elif horizontals_method == 'Geometric':
+            H = np.sqrt(np.abs(sN)*np.abs(sE))
+        elif horizontals_method == 'Azimuth':
+            H = np.abs(sN*np.cos(np.radians(azimuth)) + sE*np.sin(np.radians(azimuth)))
+        else:
+            raise ValueError('unknown horizontals_method %s'%horizontals_method)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            HV[k:k+chunk] = (W @ H.T).T/(W @ np.abs(sZ).T).T
+    lnHV = np.log(HV)
+
+    ## frequency-domain window rejection (Cox et al. 2020): reject windows whose f0 lies further than
+    ## rej_stdev lognormal standard deviations from the mean f0, until no more windows are rejected
+    band = (fc >= rej_min_freq) & (fc <= rej_max_freq)
+    ln_f0 = np.log(fc[band][np.nanargmax(HV[:, band], axis=1)])
+    keep = np.ones(len(HV), dtype=bool)
+    for _ in range(rej_it):
+        mean, std = ln_f0[keep].mean(), ln_f0[keep].std()
+        new_keep = keep & (np.abs(ln_f0 - mean) <= rej_stdev*std)
+        if new_keep.sum() == keep.sum():
+            break
+        keep = new_keep
+
+    mean_ln, std_ln = lnHV[keep].mean(axis=0), lnHV[keep].std(axis=0)
+    A, A_min, A_max = np.exp(mean_ln), np.exp(mean_ln - std_ln), np.exp(mean_ln + std_ln)
+    ln_f0_win = np.log(fc[np.nanargmax(HV[keep], axis=1)])
+    f0_win, f0_std = np.exp(ln_f0_win.mean()), np.exp(ln_f0_win.std())
+
+    with open(hv_file, 'w') as f_out:
+        f_out.write('# GEOPSY output version 1.1\n')
+        f_out.write('# Number of windows = %d\n'%keep.sum())
+        f_out.write('# f0 from average\t%g\n'%fc[np.nanargmax(A)])
+        f_out.write('# Number of windows for f0 = %d\n'%keep.sum())
+        f_out.write('# f0 from windows\t%g\t%g\t%g\n'%(f0_win, f0_win/f0_std, f0_win*f0_std))
+        f_out.write('# Peak amplitude\t%g\n'%np.nanmax(A))
+        f_out.write('# Position\t0 0 0\n')
+        f_out.write('# Category\tDefault\n')
+        f_out.write('# Frequency\tAverage\tMin\tMax\n')
+        np.savetxt(f_out, np.column_stack((fc, A, A_min, A_max)), fmt='%g', delimiter='\t')
+
+async def _geopsy(*args):
+    """
+    Run geopsy-hv with args without blocking the event loop, raise CalledProcessError when it fails.
+    When the task is cancelled geopsy-hv is killed, so that it does not keep writing into a removed scratch folder.
+    """
+    proc = await asyncio.create_subprocess_exec('geopsy-hv', *args, stdout=asyncio.subprocess.DEVNULL)
+    try:
+        returncode = await proc.wait()
+    except asyncio.CancelledError:
+        proc.kill()
+        await proc.wait()
+        raise
+    if returncode:
+        raise subprocess.CalledProcessError(proc.returncode, ['geopsy-hv', *args])
+
+async def geopsy_window(sem, wf, station, out_folder, params, tStart_hv, want_rotation):
+    """
+    Run the Geopsy HV (and optionally HV rotate) module for one process_len of wf, params being the filled-in
+    params file. At most as many windows as sem allows run at the same time.
+    """
+    async with sem:
+        print(tStart_hv)
+
+        # adapt an auto-PARAM file with the given parameters so that for each processing loop the same param is used
+        ### Each window gets a private scratch folder holding its params file and the geopsy output,
+        ### so parallel workers cannot overwrite each other's params, .hv or .log files
+        tmp_folder = tempfile.mkdtemp(prefix='{0}.{1}.'.format(station, tStart_hv), dir=out_folder)
+        params_path = os.path.join(tmp_folder, 'geopsy-hv-auto.params')
+        with open(params_path, 'w') as f:
+            f.write(params)
+
+        try:
+            ### Run geopsy for each step in the loop
+            #!{''.join(geopsy_exe)} -hv {''.join(wf)} -param {params_path} -o {tmp_folder}
+            await _geopsy('-hv', wf, '-param', params_path, '-o', tmp_folder)
+
+            ### geopsy writes no .hv when no window of this process_len could be used (e.g. a data gap)
+            hv_src = os.path.join(tmp_folder, '{0}.hv'.format(station))
+            if not os.path.lexists(hv_src):
+                log.warning('no .hv file for %s %s, skipped', station, tStart_hv)
+                return
+
+            ### Rename the .hv output file and the .log to save a unique files for each processed process_len
+            ### saving the .log files is useful as these can be loaded in Geopsy to manually check the processed data 
+            os.replace(hv_src, os.path.join(out_folder, '{0}.{1}.hv'.format(station, tStart_hv)))
+            os.replace(os.path.join(tmp_folder, '{0}.log'.format(station)), os.path.join(out_folder, '{0}.{1}.log'.format(station, tStart_hv)))
+
+            # if want_rotation is selected, also the HV rotate module will be executed and stored in the outfolder  
+
+            if want_rotation:
+
+                # run the geopsy rotation
+                await _geopsy('-rotate', wf, '-param', params_path, '-o', tmp_folder)
+
+                ### Rename the .hv.grid output file
+                os.replace(hv_src, os.path.join(out_folder, '{0}.{1}.hv.grid'.format(station, tStart_hv)))
+        except subprocess.CalledProcessError as e:
+            ### a failing geopsy run only loses this process_len, the other windows of the file go on
+            log.warning('geopsy-hv failed for %s %s, skipped: %s', station, tStart_hv, e)
+            return
+        finally:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+
+        print('%s %s done'%(station, tStart_hv))
+
+def _run_async(coro):
+    """asyncio.run that also works when an event loop is already running, e.g. with %run in a Jupyter notebook."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+def run_HV(wf, node_ID, output_folder, process_len, time_window_len, win_overlap, threshold_pct, KO,
+           min_freq, max_freq, N_samples, want_rotation, rotation_steps, threshold, horizontals_method,
+           azimuth, rej_min_freq, rej_max_freq, rej_stdev, rej_it, engine='geopsy', n_concurrent=1):
+    """
+    Run the Geopsy HV (and optionally HV rotate) module on one waveform file, once for every process_len,
+    with up to n_concurrent geopsy-hv runs at the same time.
+    With engine='python' the H/V curves are computed in-process with hv_python instead of geopsy-hv.
+    All processing parameters are passed explicitly so that the function can be dispatched to worker processes.
+    """
     ## Grab the station info
-    st = read(wf)
+    ## for geopsy only the headers are needed here, geopsy reads the samples itself
+    if not glob.glob(wf):
+        raise FileNotFoundError(errno.ENOENT, 'No waveform file matching', wf)
+    try:
+        st = read(wf, headonly=(engine == 'geopsy'))
+    except Exception as e:
+        ## obspy raises a bare Exception when none of the files holds a readable record, e.g. a truncated MiniSEED,
+        ## and a TypeError for a file of unknown format, e.g. an empty file. Both mean the file cannot be read
+        if not (type(e) is Exception or (type(e) is TypeError and str(e).startswith('Unknown format'))):
+            raise
+        raise OSError('cannot read %s: %s'%(wf, e)) from e
     tr = st[0]
     start = tr.stats.starttime
     end = tr.stats.endtime
     station = '%s_%s'%(tr.stats.network, tr.stats.station)
     print('station: %s'%station)
 
+    ### Make a folder for each station output
+    out_folder = os.path.join(output_folder, node_ID)
+    os.makedirs(out_folder, exist_ok=True)
+
     delta = end-start
+    ## process_len = 0: hand the whole file to geopsy in a single run, which averages all its windows into one .hv
+    if process_len <= 0:
+        process_len = delta
     print("start: %s"%start)
     print("end: %s"%end) 
     print("We get %s .hv files of %ss length out of stream"%(int(delta/process_len), process_len))
 
+    ## The windows follow each other at a fixed cadence, so all start/end time strings are built once up front
+    starts = [start + k*process_len for k in range(int(np.ceil(delta/process_len)))]
+    tStarts = ['%s%05.2f'%(t.strftime('%Y%m%d%H%M'), t.second) for t in starts]
+    tStarts_hv = [t.strftime('%Y%m%d%H%M%S') for t in starts]
+    tEnds = ['%s%05.2f'%(t.strftime('%Y%m%d%H%M'), t.second) for t in (s + process_len for s in starts)]
 
-    for i in np.arange(start, end, process_len):
-            time = i
-            print(time)
-            tStart = '%s%02d%02d%02d%02d%#05.2f'%(time.year, time.month, time.day, time.hour, time.minute, time.second)
-            tStart_hv = '%s%02d%02d%02d%02d%#02d'%(time.year, time.month, time.day, time.hour, time.minute, time.second)
-            endtime = time + process_len
-            tEnd = '%s%02d%02d%02d%02d%#05.2f'%(endtime.year, endtime.month, endtime.day, endtime.hour, endtime.minute, endtime.second)
-
-            # get the empty auto-paramString
-            paramsString = get_paramString()
-
-            # adapt an auto-PARAM file with the given parameters so that for each processing loop the same param is used
-            with open('geopsy-hv-auto.params', 'w') as f:
-                f.write(paramsString.format(
+    # get the empty auto-paramString and fill in the parameters that are the same for every window,
+    # the time fields are kept as placeholders and filled in per window
+    paramsString = get_paramString().format(
                     # Select start and end time from waveform
-                    tStart=tStart,
+                    tStart='{tStart}',
                     # Select end time from waveform
-                    tEnd=tEnd,
+                    tEnd='{tEnd}',
                     # Adapt the parameters of previously chosen parameters 
                     threshold=threshold,
                     threshold_pct=threshold_pct,
@@ -89,189 +340,165 @@ def run_HV(wf):
                     rej_max_freq=rej_max_freq, 
                     rej_stdev=rej_stdev,
                     rej_it = rej_it
-                    ))
+                    )
 
-            ### Make a folder for each station output
-            os.makedirs(output_folder+node_ID, exist_ok=True)
-            out_folder = ''.join(output_folder+node_ID)
+    if engine == 'python':
+        for time, tStart_hv in zip(starts, tStarts_hv):
+            print(time)
+            ### the rotate module and the .log file are only available with geopsy
+            try:
+                hv_python(st.slice(time, time + process_len), os.path.join(out_folder, '{0}.{1}.hv'.format(station, tStart_hv)),
+                          time_window_len, win_overlap, KO, min_freq, max_freq, N_samples, horizontals_method, azimuth,
+                          rej_min_freq, rej_max_freq, rej_stdev, rej_it)
+            except ValueError as e:
+                ### e.g. a data gap leaves no usable window in this process_len
+                log.warning('no .hv file for %s %s, skipped: %s', station, tStart_hv, e)
+            print('**********************************')
+        return
 
-            ### Run geopsy for each step in the loop
-            #!{''.join(geopsy_exe)} -hv {''.join(wf)} -param geopsy-hv-auto.params -o {''.join(output_folder+node_ID)}
-            subprocess.call(['geopsy-hv', '-hv', wf, '-param', 'geopsy-hv-auto.params', '-o', os.path.join(output_folder,node_ID)])
+    ### geopsy-hv runs as asynchronous subprocesses, so one process can keep n_concurrent of them busy
+    async def run_windows():
+        sem = asyncio.Semaphore(n_concurrent)
+        await asyncio.gather(*(geopsy_window(sem, wf, station, out_folder, paramsString.format(tStart=tStart, tEnd=tEnd),
+                                             tStart_hv, want_rotation)
+                               for tStart, tStart_hv, tEnd in zip(tStarts, tStarts_hv, tEnds)))
 
-            ### Rename the .hv output file and the .log to save a unique files for each processed process_len
-            ### saving the .log files is useful as these can be loaded in Geopsy to manually check the processed data 
-            print(node_ID, station)
-            os.renames(os.path.join(output_folder, '{0}/{1}.hv'.format(node_ID, station)), os.path.join(output_folder, '{0}/{1}.{2}.hv'.format(node_ID, station, tStart_hv)))
-            os.renames(os.path.join(output_folder, '{0}/{1}.log'.format(node_ID, station)), os.path.join(output_folder, '{0}/{1}.{2}.log'.format(node_ID, station, tStart_hv)))
+    _run_async(run_windows())
+    print('**********************************')
 
-            # if want_rotation is selected, also the HV rotate module will be executed and stored in the outfolder  
-            
-            if want_rotation:
-
-                # run the geopsy rotation
-                subprocess.call(['geopsy-hv', '-rotate', wf, '-param', 'geopsy-hv-auto.params', '-o', os.path.join(output_folder,node_ID)])
-
-                ### Rename the .hv.grid output file
-                os.renames(os.path.join(output_folder, '{0}/{1}.hv'.format(node_ID, station)), os.path.join(output_folder, '{0}/{1}.{2}.hv.grid'.format(node_ID, station, tStart_hv)))
-            
-            print('**********************************')
+def read_files(directory, mode='fdsn'):
+    """
+    Group the files in directory per recording, so that all components of a recording are processed together.
+    mode = 'fdsn': the component letter (14th character) is replaced by a '*' wildcard, e.g. 8N.HB04.00.HH*.D.2024.030
+    mode = 'smartsolo': the last two dot-separated fields (component and extension) are dropped from the filename
+    """
+    names = os.listdir(directory)
+    if mode == 'fdsn':
+        # filenames too short to hold a component letter are not waveform files
+        for n in names:
+            if len(n) <= 13:
+                log.debug('%s is not an FDSN waveform filename, ignored', n)
+        return sorted({n[:13] + '*' + n[14:] for n in names if len(n) > 13})
+    else:
+        return sorted({n.rsplit('.', 2)[0] for n in names})
+
+def process_file(wf, node_ID, params):
+    """run_HV on one waveform file, a file that cannot be processed is logged and skipped."""
+    print(wf)
+    try:
+        run_HV(wf, node_ID, **params)
+    except (OSError, ObsPyException, ValueError, RuntimeError, subprocess.CalledProcessError):
+        log.exception('skipping %s', wf)
 
 
 ########################
 ##### Main program  ####
 ########################
 
-# import OptionParser class 
-# from optparse module.
-from optparse import OptionParser
-
-# create a OptionParser
-parser = OptionParser()
-     
-### param details
-parser.add_option('-p', '--process_len', type = 'int',
-                      default = 3600, dest = 'process_len',
-                      help = "Overall processing lengths - time for which we compute the total HV-curve")
-parser.add_option("-w", "--time_window_len", type == 'int', 
-                  default = 60, dest = 'time_window_len',
-                  help = "window length for each HV curve")
-parser.add_option("-t", "--threshold_pct", type == 'float', 
-                  default = 0.5, dest = 'threshold_pct',
-                  help = "window length for each HV curve")
-parser.add_option("-o", "--win_overlap", type == 'int', default = 50,
-                  dest = 'win_overlap',
-                      help = "% overlapping windows")
-parser.add_option("-k", "--KO", type == 'float', default = 0.2, dest = 'KO',
-                      help = "Konno-Omachi Smoothing")
-parser.add_option("-l", "--min_freq", type == 'float', default = 0.2, dest = 'min_freq',
-                      help = "lower frequency bound")
-parser.add_option("-u", "--max_freq", type == 'float', default = 50, dest = 'max_freq',
-                      help = "upper frequency bound")
-parser.add_option("-n", "--N_samples", type == 'int', default = 500, dest = 'N_samples',
-                      help = "Nr of SAMPLES_NUMBER_FREQUENCY={S_N_FREQ}")
-parser.add_option("-r", "--want_rotation", default = False, action="store_true", dest = 'want_rotation',
-                      help = "True if you want run the HV rotate module ")
-parser.add_option("-d", "--rotation_steps", type == 'int', default = 10, dest = 'rotation_steps',
-                      help = "degree of rotation steps in the rotate module")
-
-(options, args) = parser.parse_args()
-
-# overall processing lengths (time for which we compute the total HV-curve)
-#process_len = 3600. # [s] standard 1 hour
-process_len = options.process_len # [s] standard 1 hour
-
-# window length for each HV curve
-#time_window_len = 360. # [s] standard 60 or 120s
-time_window_len = options.time_window_len # [s] standard 60 or 120s
-
-#overlapping windows
-#win_overlap = 50
-win_overlap = options.win_overlap
-
-#threshold_pct = 0.4
-threshold_pct = options.threshold_pct
-
-#Smoothing (in digits)
-#KO = 0.2
-KO = options.KO
-
-# lower frequency bound
-#min_freq = 0.1 # [Hz]
-min_freq = options.min_freq
-
-# upper frequency bound
-#max_freq = 100 # [Hz]
-max_freq = options.max_freq 
-
-# Nr of SAMPLES_NUMBER_FREQUENCY={S_N_FREQ}
-#N_samples = 2000
-N_samples = options.N_samples
-
-# in case you want run the HV rotate module (see exercise 4)
-#want_rotation = False # True, False
-want_rotation = options.want_rotation # True, False
-
-#rotation_steps = 10 # [degree]
-rotation_steps = options.rotation_steps
-
-
-# fixed params
-threshold = 'RelativeSampleThreshold'
-# how to calculate horizontals (Squared, Energy, Azimuth, Geometric)
-horizontals_method = 'Squared' # standard 'Squared'
-##HORIZONTAL_AZIMUTH is used only when HORIZONTAL_COMPONENTS== 'Azimuth'
-azimuth = 0
-
-# Using the Cox et al. 2020 filtering 
-#FREQUENCY_WINDOW_REJECTION_MINIMUM_FREQUENCY
-rej_min_freq = 0.5
-#FREQUENCY_WINDOW_REJECTION_MAXIMUM_FREQUENCY
-rej_max_freq = 50
-#FREQUENCY_WINDOW_REJECTION_STDDEV_FACTOR
-rej_stdev = 1.8
-#FREQUENCY_WINDOW_REJECTION_MAXIMUM_ITERATIONS
-rej_it = 500
-
-
-#################### loop
-
-### for smartSolo node data
-def read_files(directory):   
-    files = []
-    # Loop through the files in the directory
-    for filename in os.listdir(directory):
-        # Split the filename to get the base name and component
-        node = filename.split('.')[0]
-        basefile = filename.rsplit('.', 2)[0]
-        files.append(basefile)
-    
-    files = np.unique(files)
-    return files
-
-# for FDSN data
-def read_files(directory):   
-    files = []
-    # Loop through the files in the directory
-    for filename in os.listdir(directory):
-        try:
-            # Split the filename to get the base name and component
-            l = list(filename)
-            l[13] = '*'
-            basefile = ''.join(l)
-            #basefile = filename.rsplit('.', 2)[0]
-            #filename[14] = '*'
-            #basefile = filename
-            print(filename)
-            files.append(basefile)
-        except Exception:
-            print(l)
-            traceback.print_exc()
-            continue
-    
-    files = np.unique(files)
-    return files
-
-
-current_folder = os.getcwd()
-#current_folder = '/mnt/LargeMEM/SKIENCE25/DATA/MSEED'
-
-# Specify the directory containing the waveform files
-#directory = os.path.join(current_folder, 'Raw_Data')
-directory = 'Raw_Data'
-
-# Give outputfolder where to save the .hv files
-output_folder = os.path.join(current_folder, 'Analysed_Skience25/')
-files = read_files(directory)
-
-for file in files:
-    node_ID = str(os.path.split(file)).split('.')[1]
-    wf = os.path.join(directory, file)
-    print(wf)
-
-    try:
-        run_HV(wf)
-    except:
-        continue
-
-print('Job Done')
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute .hv files for all waveform files in Raw_Data with geopsy-hv")
+
+    ### param details
+    parser.add_argument('-p', '--process_len', type=int, default=3600,
+                        help="Overall processing lengths - time for which we compute the total HV-curve [s], standard 1 hour "
+                             "(0 = whole file in one geopsy run)")
+    parser.add_argument("-w", "--time_window_len", type=int, default=60,
+                        help="window length for each HV curve [s], standard 60 or 120s")
+    parser.add_argument("-t", "--threshold_pct", type=float, default=0.5,
+                        help="bad sample threshold [%%]")
+    parser.add_argument("-o", "--win_overlap", type=int, default=50,
+                        help="%% overlapping windows")
+    parser.add_argument("-k", "--KO", type=float, default=0.2,
+                        help="Konno-Omachi Smoothing (in digits)")
+    parser.add_argument("-l", "--min_freq", type=float, default=0.2,
+                        help="lower frequency bound [Hz]")
+    parser.add_argument("-u", "--max_freq", type=float, default=50,
+                        help="upper frequency bound [Hz]")
+    parser.add_argument("-n", "--N_samples", type=int, default=500,
+                        help="Nr of SAMPLES_NUMBER_FREQUENCY")
+    parser.add_argument("-r", "--want_rotation", action="store_true",
+                        help="run the HV rotate module as well (see exercise 4)")
+    parser.add_argument("-d", "--rotation_steps", type=int, default=10,
+                        help="degree of rotation steps in the rotate module")
+    parser.add_argument("-e", "--engine", default='geopsy', choices=['geopsy', 'python'],
+                        help="compute the H/V curves with geopsy-hv or in-process with numpy/scipy (no rotate module)")
+    parser.add_argument("-m", "--mode", default='fdsn', choices=['fdsn', 'smartsolo'],
+                        help="file naming of the raw data: fdsn or smartsolo")
+    parser.add_argument("-c", "--n_concurrent", type=int, default=1,
+                        help="Nr of geopsy-hv runs per waveform file executed at the same time")
+    parser.add_argument("-j", "--n_jobs", type=int, default=1,
+                        help="Nr of waveform files processed in parallel (-1 uses all cores)")
+
+    args = parser.parse_args()
+
+    # a window overlap of 100% or more would never advance to the next window
+    if not 0 <= args.win_overlap < 100:
+        parser.error('-o/--win_overlap must be at least 0 and less than 100')
+    # with 0 concurrent geopsy-hv runs no window could ever start, joblib has no meaning for 0 jobs
+    if args.n_concurrent < 1:
+        parser.error('-c/--n_concurrent must be at least 1')
+    if args.n_jobs == 0:
+        parser.error('-j/--n_jobs must not be 0')
+
+    # the python engine has no rotate module, no bad sample threshold (windows with gaps are dropped) and no subprocesses
+    if args.engine == 'python':
+        for option, dest in (('-r/--want_rotation', 'want_rotation'), ('-d/--rotation_steps', 'rotation_steps'),
+                             ('-t/--threshold_pct', 'threshold_pct'), ('-c/--n_concurrent', 'n_concurrent')):
+            if getattr(args, dest) != parser.get_default(dest):
+                parser.error('%s is not supported with --engine python'%option)
+
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s %(message)s')
+
+    # the file naming and the nr of parallel workers only steer the loop, all other options are passed on to run_HV
+    hv_params = vars(args)
+    mode = hv_params.pop('mode')
+    n_jobs = hv_params.pop('n_jobs')
+
+
+    # fixed params
+    threshold = 'RelativeSampleThreshold'
+    # how to calculate horizontals (Squared, Energy, Azimuth, Geometric)
+    horizontals_method = 'Squared' # standard 'Squared'
+    ##HORIZONTAL_AZIMUTH is used only when HORIZONTAL_COMPONENTS== 'Azimuth'
+    azimuth = 0
+
+    # Using the Cox et al. 2020 filtering 
+    #FREQUENCY_WINDOW_REJECTION_MINIMUM_FREQUENCY
+    rej_min_freq = 0.5
+    #FREQUENCY_WINDOW_REJECTION_MAXIMUM_FREQUENCY
+    rej_max_freq = 50
+    #FREQUENCY_WINDOW_REJECTION_STDDEV_FACTOR
+    rej_stdev = 1.8
+    #FREQUENCY_WINDOW_REJECTION_MAXIMUM_ITERATIONS
+    rej_it = 500
+
+
+    #################### loop
+
+    current_folder = os.getcwd()
+    #current_folder = '/mnt/LargeMEM/SKIENCE25/DATA/MSEED'
+
+    # Specify the directory containing the waveform files
+    #directory = os.path.join(current_folder, 'Raw_Data')
+    directory = 'Raw_Data'
+
+    # Give outputfolder where to save the .hv files
+    output_folder = os.path.join(current_folder, 'Analysed_Skience25/')
+    files = read_files(directory, mode)
+
+    params = dict(hv_params,
+                  output_folder=output_folder,
+                  threshold=threshold,
+                  horizontals_method=horizontals_method,
+                  azimuth=azimuth,
+                  rej_min_freq=rej_min_freq,
+                  rej_max_freq=rej_max_freq,
+                  rej_stdev=rej_stdev,
+                  rej_it=rej_it)
+
+    ### every waveform file is independent, so the files are spread over n_jobs worker processes
+    Parallel(n_jobs=n_jobs, prefer='processes')(
+        delayed(process_file)(os.path.join(directory, file), str(os.path.split(file)).split('.')[1], params)
+        for file in files)
+
+    print('Job Done')
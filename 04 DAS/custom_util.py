@@ -1,78 +1,75 @@
+import functools
+import os
+
 import numpy as np
+import pandas as pd
 import xdas as xd
 
+#-- Conversion to strain-rate units, folded into one factor so the data is only multiplied once
+_SCALE = 116.0 / 8192.0 * 400.0 / 10.0 * 1e-9
+
 def apply_scaling(da):
-    da = da * 116.0 / 8192.0 * 400.0 / 10.0 * 1e-9
+    da = da * _SCALE
     return da
 
+def _nearest_index(values, targets):
+    """Index of the element of the sorted array `values` closest to each of `targets`."""
+    values = np.asarray(values)
+    #-- With a single value idx-1 would be -1, every target is then nearest to element 0
+    if len(values) == 1:
+        return np.zeros(np.shape(targets), dtype=np.intp)
+    idx = np.clip(np.searchsorted(values, targets), 1, len(values)-1)
+    return np.where(np.abs(values[idx]-targets) < np.abs(values[idx-1]-targets), idx, idx-1)
+
+@functools.lru_cache(maxsize=8)
+def _load_segments(path, mtime):
+    """Parse a segments file once; `mtime` is part of the cache key so an edited file is read again."""
+    tmp = pd.read_csv(path, sep=r"\s+", header=None, dtype=np.float64).to_numpy()
+    #-- The arrays are shared between calls, so protect them against accidental in-place edits
+    tmp.setflags(write=False)
+    return tuple(tmp[:,i] for i in range(6))
+
 def apply_mapping(da, segments_filename="good_segments.txt"):
 
-    tmp = np.loadtxt("good_segments.txt")
+    x1, y1, d1, x2, y2, d2 = _load_segments(segments_filename, os.path.getmtime(segments_filename))
     segment = {}
-    segment['x1'] = tmp[:,0]
-    segment['y1'] = tmp[:,1]
-    segment['d1'] = tmp[:,2]
-    segment['x2'] = tmp[:,3]
-    segment['y2'] = tmp[:,4]
-    segment['d2'] = tmp[:,5]
+    segment['x1'] = x1
+    segment['y1'] = y1
+    segment['d1'] = d1
+    segment['x2'] = x2
+    segment['y2'] = y2
+    segment['d2'] = d2
 
 
     #-- Each channel is associated with a distance along the fiber (based on metadata like channel spacing)
     channels_dd_original = da.coords['distance'].values
 
-    icount = 0
-    tie_indices = []
-    tie_distances = []
-    tie_lat = []
-    tie_lon = []
-    mapped_ranges = []
-
-    #-- Now we loop through each segment, find the channel nearest to the reported start and end, and interpolate
-    for i in range(len(segment['x1'])):
-        i1 = np.argmin(np.abs(channels_dd_original - segment['d1'][i]))
-        i2 = np.argmin(np.abs(channels_dd_original - segment['d2'][i]))
-        nchan = i2-i1
-        
-        #-- Each start of a segment is a "tie", where the distance, lat, lon are locked in.
-        tie_indices.append(icount)
-        tie_distances.append(segment['d1'][i])
-        tie_lat.append(segment['y1'][i])
-        tie_lon.append(segment['x1'][i])
-        icount += nchan
-
-        #-- If there is a gap, we need to lock in the end of that segment as a new tie-point:
-        if(i<len(segment['x1'])-1):
-            if(segment['d2'][i] != segment['d1'][i+1]):
-                tie_indices.append(icount)
-                icount += 1
-                tie_distances.append(segment['d2'][i])
-                tie_lat.append(segment['y2'][i])
-                tie_lon.append(segment['x2'][i])
-        #-- At the very end, again need to lock in the end of that segment
-        else:
-            tie_indices.append(icount)
-            tie_distances.append(segment['d2'][i])
-            tie_lat.append(segment['y2'][i])
-            tie_lon.append(segment['x2'][i])
-        mapped_ranges.append([i1,i2])
+    #-- Find the channel nearest to the reported start and end of every segment at once.
+    #-- The distances increase monotonically along the fiber, so a binary search replaces a full scan per segment.
+    i1 = _nearest_index(channels_dd_original, segment['d1'])
+    i2 = _nearest_index(channels_dd_original, segment['d2'])
+    nchan = i2-i1
+
+    #-- Each start of a segment is a "tie", where the distance, lat, lon are locked in.
+    #-- If there is a gap, we need to lock in the end of that segment as a new tie-point, this costs one extra channel.
+    #-- At the very end, again need to lock in the end of that segment
+    gap = np.append(segment['d2'][:-1] != segment['d1'][1:], True)
+    icount = np.concatenate(([0], np.cumsum(nchan + gap)[:-1]))
+    is_tie = np.column_stack((np.ones_like(gap), gap))
+
+    #-- Boolean indexing flattens row by row, so the end tie of a segment follows its start tie
+    tie_indices = np.column_stack((icount, icount + nchan))[is_tie].tolist()
+    tie_distances = np.column_stack((segment['d1'], segment['d2']))[is_tie].tolist()
+    tie_lat = np.column_stack((segment['y1'], segment['y2']))[is_tie].tolist()
+    tie_lon = np.column_stack((segment['x1'], segment['x2']))[is_tie].tolist()
 
     #-- Now for each segment we need to extract and collect all the actual DAS data in "da"
-    for i in range(len(mapped_ranges)):
-
-        #-- Figure out the indices. If there's a gap, we need to catch the final trace up to it.
-        i0 = mapped_ranges[i][0]
-        i1 = mapped_ranges[i][1]
-        if(i<len(mapped_ranges)-1):
-            if(mapped_ranges[i][1]!=mapped_ranges[i+1][0]):
-                i1 += 1
-        else:
-            i1 += 1
-        
-        #-- Actually collect the da from each chunk
-        if(i==0):
-            da2 = da[:, i0:i1]
-        else:
-            da2 = xd.concatenate([da2, da[:, i0:i1]],dim = "distance")
+    #-- Figure out the indices. If there's a gap, we need to catch the final trace up to it.
+    i_end = i2 + np.append(i2[:-1] != i1[1:], True)
+    ranges = zip(i1.tolist(), i_end.tolist())
+
+    #-- Actually collect the da from each chunk, with a single concatenation so the data is copied only once
+    da2 = xd.concatenate([da[:, start:stop] for start, stop in ranges], dim="distance")
 
     #-- Make new Coordinate containers for our distances, lat, lon
     distance_mapped = xd.Coordinate(
@@ -1,60 +1,38 @@
 import numpy
-def roof_edges2D(mult = 1, Lat = 0, Lon = 0):
-    offsetLon = 681437.8 -Lon
-    offsetLat = 248919.2 -Lat
+# Roof corners (Lon, Lat) in the order N, E_1, E_2, W, S, E_5, E_6, E
+_ROOF_EDGES = numpy.array([[681443.103, 248954.576],
+                           [681429.922, 248934.161],
+                           [681431.376, 248912.610],
+                           [681426.233, 248895.830],
+                           [681447.497, 248889.417],
+                           [681460.536, 248909.601],
+                           [681459.040, 248927.087],
+                           [681462.783, 248942.503]])
+_N, _W, _S, _E = 0, 3, 4, 7
+_ORIGIN = numpy.array([681437.8, 248919.2])
+
+def _shifted_edges(mult, Lon, Lat):
+    offset = _ORIGIN - numpy.array([Lon, Lat])
+    return (_ROOF_EDGES - offset) * mult
 
-    NLon = (681443.103 - offsetLon)*mult
-    NLat = (248954.576 - offsetLat)*mult
-    ELon = (681462.783 - offsetLon)*mult
-    ELat = (248942.503 - offsetLat)*mult
-    E_1 = (681429.922 - offsetLon)*mult
-    N_1 = (248934.161 - offsetLat)*mult
-    E_2 = (681431.376 - offsetLon)*mult
-    N_2 = (248912.610 - offsetLat)*mult
-    WLon = (681426.233 - offsetLon)*mult
-    WLat = (248895.830 - offsetLat)*mult
-    SLon = (681447.497 - offsetLon)*mult
-    SLat = (248889.417 - offsetLat)*mult
-    E_5 = (681460.536 - offsetLon)*mult
-    N_5 = (248909.601 - offsetLat)*mult
-    E_6 = (681459.040 - offsetLon)*mult
-    N_6 = (248927.087 - offsetLat)*mult
-    edges = numpy.array([[NLon, NLat],[E_1,N_1],[E_2,N_2],[WLon,WLat],[SLon,SLat],[E_5,N_5],[E_6,N_6],[ELon,ELat]])
+def roof_edges2D(mult = 1, Lat = 0, Lon = 0):
+    edges = _shifted_edges(mult, Lon, Lat)
     return edges
 
 def roof_edges3D(mult=1, Lon=0, Lat=0, up=0):
-    offsetLon = 681437.8 - Lon
-    offsetLat = 248919.2 - Lat
+    edges = _shifted_edges(mult, Lon, Lat)
+    ELon, ELat = edges[_E]
 
-    NLon = (681443.103 - offsetLon) * mult
-    NLat = (248954.576 - offsetLat) * mult
-    ELon = (681462.783 - offsetLon) * mult
-    ELat = (248942.503 - offsetLat) * mult
-    E_1 = (681429.922 - offsetLon) * mult
-    N_1 = (248934.161 - offsetLat) * mult
-    E_2 = (681431.376 - offsetLon) * mult
-    N_2 = (248912.610 - offsetLat) * mult
-    WLon = (681426.233 - offsetLon) * mult
-    WLat = (248895.830 - offsetLat) * mult
-    SLon = (681447.497 - offsetLon) * mult
-    SLat = (248889.417 - offsetLat) * mult
-    E_5 = (681460.536 - offsetLon) * mult
-    N_5 = (248909.601 - offsetLat) * mult
-    E_6 = (681459.040 - offsetLon) * mult
-    N_6 = (248927.087 - offsetLat) * mult
-
-    Lon1 = 681437.8 - offsetLon  # check again from registration!!
-    Lat1 = 248919.2 - offsetLat
+    Lon1 = Lon  # check again from registration!!
+    Lat1 = Lat
 
     ER = (124.37) * mult + up
     E23 = (78.7 - 0.32) * mult
     E6 = (21.78 - 0.32) * mult
     E0 = (0) * mult
     BE0 = (0) * mult
-    edges_gfloor = [list(zip([NLon, E_1, E_2, WLon, SLon, E_5, E_6, ELon], [NLat, N_1, N_2, WLat, SLat, N_5, N_6, ELat],
-                             [0, 0, 0, 0, 0, 0, 0, 0], ))]
-    edges_roof = [list(zip([NLon, E_1, E_2, WLon, SLon, E_5, E_6, ELon], [NLat, N_1, N_2, WLat, SLat, N_5, N_6, ELat],
-                           [ER, ER, ER, ER, ER, ER, ER, ER], ))]
+    edges_gfloor = [numpy.column_stack((edges, numpy.zeros(len(edges))))]
+    edges_roof = [numpy.column_stack((edges, numpy.full(len(edges), ER)))]
     return edges_gfloor, edges_roof, ER, E23, E6, E0, BE0, ELon, ELat, Lon1, Lat1
 
 def set_axes_equal(ax):
@@ -82,18 +60,6 @@ def set_axes_equal(ax):
     ax.set_ylim3d([y_middle - plot_radius, y_middle + plot_radius])
 
 def H_array2D(mult=1, Lat=0, Lon=0):
-    offsetLon = 681437.8 - Lon
-    offsetLat = 248919.2 - Lat
-
-    NLon = (681443.103 - offsetLon) * mult
-    NLat = (248954.576 - offsetLat) * mult
-    ELon = (681462.783 - offsetLon) * mult
-    ELat = (248942.503 - offsetLat) * mult
-    WLon = (681426.233 - offsetLon) * mult
-    WLat = (248895.830 - offsetLat) * mult
-    SLon = (681447.497 - offsetLon) * mult
-    SLat = (248889.417 - offsetLat) * mult
-    Lon1 = 0 * mult
-    Lat1 = 0 * mult
-    edges = numpy.array([[Lon1, Lat1], [NLon, NLat], [ELon, ELat], [SLon, SLat], [WLon, WLat]])
+    edges = numpy.zeros((5, 2))
+    edges[1:] = _shifted_edges(mult, Lon, Lat)[[_N, _E, _S, _W]]
     return edges
\ No newline at end of file